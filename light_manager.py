@@ -1,38 +1,105 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import time, json, datetime, random, logging, sys, os, warnings
-from gpiozero import LED
+import time, datetime, logging, logging.handlers, sys, os, warnings, heapq, threading, atexit, signal, mmap, selectors, collections
 from adafruit_extended_bus import ExtendedI2C as I2C
 import adafruit_tsl2561
 
+# orjson parses/serializes bytes directly and is much faster; fall back to stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+    json_dumps = lambda obj: json.dumps(obj).encode()
+
 # -------------------- CONFIG --------------------
 CONFIG_FILE = "/home/pi/light_schedule.json"
 STATE_FILE  = "/home/pi/light_state.json"
 LOG_FILE    = "/home/pi/light_manager.log"
+GPIO_MEM    = "/dev/gpiomem"
 
-os.environ["GPIOZERO_PIN_FACTORY"] = "rpigpio"
 warnings.filterwarnings("ignore")
 
+LOG_FORMAT = "%(asctime)s %(message)s"
+
+# Buffer file records to spare the SD card; warnings and errors flush immediately
+file_handler = logging.FileHandler(LOG_FILE, mode="a")
+file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+log_buffer = logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING, target=file_handler)
+LOG_FLUSH_INTERVAL = 30 * 60   # seconds buffered records may wait before hitting the file
+
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout), logging.FileHandler(LOG_FILE, mode="a")]
+    format=LOG_FORMAT,
+    handlers=[logging.StreamHandler(sys.stdout), log_buffer]
 )
+atexit.register(log_buffer.flush)
+signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))   # run atexit handlers on systemd stop
 logging.info(">>> light_manager.py STARTED <<<")
 
 # -------------------- GPIO --------------------
+# Direct BCM283x register access through /dev/gpiomem: one 32-bit store per toggle.
+# Indices are word offsets; the registers must only be accessed as whole words.
+GPFSEL0 = 0x00 // 4   # function select, 3 bits per pin, 10 pins per register
+GPSET0  = 0x1C // 4   # write 1 to drive pin high
+GPCLR0  = 0x28 // 4   # write 1 to drive pin low
+
+_fd = os.open(GPIO_MEM, os.O_RDWR | os.O_SYNC)
+gpio = mmap.mmap(_fd, 4096, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+os.close(_fd)
+regs = memoryview(gpio).cast("I")   # word-sized loads/stores (struct would go byte by byte)
+
+
+def gpio_outputs(pins):
+    """Configure pins as outputs with one read-modify-write per GPFSEL register"""
+    fsel = {}
+    for pin in pins:
+        fsel.setdefault(GPFSEL0 + pin // 10, []).append((pin % 10) * 3)
+    for reg, shifts in fsel.items():
+        val = regs[reg]
+        for shift in shifts:
+            val = (val & ~(0b111 << shift)) | (0b001 << shift)
+        regs[reg] = val
+
+
+def gpio_on(pin):
+    regs[GPSET0] = 1 << pin
+
+
+def gpio_off(pin):
+    regs[GPCLR0] = 1 << pin
+
+
 SPOTS = {
-    "main":    LED(13),
-    "aux":     LED(19),
-    "gallery": LED(26),
+    "main":    13,
+    "aux":     19,
+    "gallery": 26,
 }
 
-STATUS_LED = LED(5)
-STATUS_LED.on()
+NAMES = tuple(SPOTS)   # bit order of decide() masks
 
-for s in SPOTS.values():
-    s.off()
+STATUS_LED = 5
+SPOT_MASK  = sum(1 << pin for pin in SPOTS.values())
+
+# Latch spots low before switching them to outputs so they never glitch on,
+# then light the status LED: one store for all spots, one for the status LED
+regs[GPCLR0] = SPOT_MASK
+gpio_outputs((*SPOTS.values(), STATUS_LED))
+regs[GPSET0] = 1 << STATUS_LED
+
+# -------------------- RELOAD --------------------
+# SIGHUP writes to a self-pipe so the main loop wakes from its sleep immediately
+wake_r, wake_w = os.pipe()
+os.set_blocking(wake_r, False)
+os.set_blocking(wake_w, False)
+
+selector = selectors.DefaultSelector()
+selector.register(wake_r, selectors.EVENT_READ)
+
+signal.signal(signal.SIGHUP, lambda *_: os.write(wake_w, b"x"))
 
 # -------------------- SENSOR --------------------
 i2c = I2C(3)
@@ -41,183 +108,382 @@ sensor.enabled = True
 time.sleep(1)
 
 # -------------------- HELPERS --------------------
+_cfg_cache = {"mtime": 0, "data": {}}
+
+
 def read_config():
+    """Return parsed config, re-reading the file only when its mtime changes"""
     try:
-        with open(CONFIG_FILE) as f:
-            return json.load(f)
+        st = os.stat(CONFIG_FILE)
+    except OSError as e:
+        logging.error(f"Failed to read config: {e}")
+        return _cfg_cache["data"]
+
+    if st.st_mtime_ns == _cfg_cache["mtime"] and _cfg_cache["data"]:
+        return _cfg_cache["data"]
+
+    try:
+        with open(CONFIG_FILE, "rb") as f:
+            data = json_loads(f.read())
     except Exception as e:
         logging.error(f"Failed to read config: {e}")
-        return {}
+        return _cfg_cache["data"]
+
+    _cfg_cache["data"] = data
+    _cfg_cache["mtime"] = st.st_mtime_ns
+    return data
 
 
 def load_state():
     if os.path.exists(STATE_FILE):
         try:
-            with open(STATE_FILE) as f:
-                return json.load(f)
+            with open(STATE_FILE, "rb") as f:
+                return json_loads(f.read())
         except Exception:
             pass
     return {}
 
 
 def save_state(state):
+    """Write state atomically via a temp file so a crash never leaves it truncated"""
+    tmp = STATE_FILE + ".tmp"
     try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f)
+        with open(tmp, "wb") as f:
+            f.write(json_dumps(state))
+        os.replace(tmp, STATE_FILE)
+        return True
     except Exception as e:
         logging.error(f"Failed to save state: {e}")
+        return False
+
+
+LUX_RETRY_DELAYS = (0.05, 0.1, 0.2)   # base backoff per attempt, jittered up to 2x
+LUX_FAIL_LIMIT   = 3                  # sample intervals in a row without a read before benching
+
+lux_fail_count = 0
+lux_last_fail = float("-inf")         # when the last counted failure happened
+lux_offline_until = 0.0
+lux_outage = False                    # sensor has been benched since its last good read
 
 
 def get_lux():
-    for _ in range(3):
+    """Read lux with jittered exponential backoff; None if the read failed or the sensor is benched"""
+    global lux_fail_count, lux_last_fail, lux_offline_until, lux_outage
+    now = time.monotonic()
+    if now < lux_offline_until:
+        return None
+
+    for delay in LUX_RETRY_DELAYS:
         try:
             lux = sensor.lux
             if lux is None or lux < 0:
                 raise ValueError
+            lux_fail_count = 0
+            lux_last_fail = float("-inf")
+            if lux_outage:
+                logging.info("Lux sensor recovered")
+                lux_outage = False
             return lux
         except Exception:
-            time.sleep(0.5)
-    logging.warning("Lux read failed — assuming bright")
-    return 9999
+            from random import uniform   # only paid for once a read has failed
+            time.sleep(delay + uniform(0, delay))
+
+    # Count at most one failure per sample interval, so the worker's quick
+    # retries after a short glitch don't add up to a benched sensor
+    if now - lux_last_fail < sensor_interval:
+        return None
+    lux_fail_count += 1
+    lux_last_fail = now
+    if lux_fail_count < LUX_FAIL_LIMIT:
+        logging.debug("Lux read failed (%d in a row)", lux_fail_count)
+        return None
+
+    # Circuit breaker: leave the bus alone for one interval (well inside the
+    # 3-interval stale window) and re-enable the sensor once. Only the start
+    # of an outage is a WARNING; each one flushes the log buffer to the SD card
+    if lux_outage:
+        logging.debug("Lux sensor still failing — offline for %ss", sensor_interval)
+    else:
+        logging.warning(f"Lux sensor failed {lux_fail_count} intervals in a row — offline until it recovers")
+        lux_outage = True
+    lux_fail_count = 0
+    lux_offline_until = now + sensor_interval
+    try:
+        sensor.enabled = True
+    except Exception:
+        pass
+    return None
 
 
-def parse_time(tstr):
-    """Parse HH:MM string to datetime.time object"""
+# Last good reading, its monotonic timestamp and the interval the worker
+# sampled it at (staleness is judged against that, not the current config)
+latest_lux = {"lux": 9999.0, "ts": 0.0, "interval": 60}
+lux_lock = threading.Lock()
+lux_ready = threading.Event()
+lux_resample = threading.Event()          # set by main loop to cut the worker's wait short
+sensor_interval = 60                      # updated by main loop from config
+
+
+def lux_worker():
+    """Sample the sensor in the background and publish the latest reading"""
+    backoff = 1
+    while True:
+        interval = sensor_interval
+        lux = get_lux()
+        if lux is None:
+            wait = min(backoff, interval)
+            backoff *= 2
+        else:
+            with lux_lock:
+                latest_lux["lux"] = lux
+                latest_lux["ts"] = time.monotonic()
+                latest_lux["interval"] = interval
+            lux_ready.set()
+            backoff = 1
+            wait = interval
+        lux_resample.wait(timeout=wait)
+        lux_resample.clear()
+
+
+lux_stale = False
+
+
+def read_lux():
+    """Return the last good lux, or 9999 (bright) if it missed three sample intervals"""
+    global lux_stale
+    with lux_lock:
+        lux, ts, interval = latest_lux["lux"], latest_lux["ts"], latest_lux["interval"]
+    stale = time.monotonic() - ts > 3 * interval
+
+    # Log only the edges: a per-tick WARNING would flush the log buffer every tick
+    if stale != lux_stale:
+        if stale:
+            logging.warning("Lux reading stale — assuming bright")
+        else:
+            logging.info("Lux readings recovered")
+        lux_stale = stale
+    return 9999 if stale else lux
+
+
+def parse_minutes(tstr, offset=0):
+    """Parse HH:MM string plus offset in seconds to minutes since midnight (0..1439)"""
     h, m = map(int, tstr.split(":"))
-    return datetime.time(h, m)
-
-
-def time_to_minutes(t):
-    """Convert time object to minutes since midnight"""
-    return t.hour * 60 + t.minute
-
-
-def is_between(now, start_str, end_str):
-    """Check if current time is between start and end (with second precision)"""
-    start = parse_time(start_str)
-    end   = parse_time(end_str)
-    t = now.time()
-    
-    # Convert to minutes for cleaner comparison
-    now_min = time_to_minutes(t)
-    start_min = time_to_minutes(start)
-    end_min = time_to_minutes(end)
-    
-    if start_min <= end_min:
-        return start_min <= now_min < end_min
-    else:
-        # Handle midnight crossing
-        return now_min >= start_min or now_min < end_min
+    return (h * 60 + m + offset // 60) % 1440
+
+
+def is_between_min(now_min, start_min, end_min):
+    """Check if minute-of-day now_min lies in [start_min, end_min), crossing midnight if needed"""
+    return (start_min <= now_min < end_min) if start_min <= end_min else (now_min >= start_min or now_min < end_min)
+
+
+def build_schedule(cfg, rnd_on, rnd_off):
+    """Precompute {name: (on_min, off_min)} with daily offsets already applied"""
+    sched = {}
+    for name in ("gallery", "aux"):
+        on_k, off_k = f"{name}_on", f"{name}_off"
+        if on_k in cfg and off_k in cfg:
+            sched[name] = (parse_minutes(cfg[on_k], rnd_on), parse_minutes(cfg[off_k], rnd_off))
 
+    # Main is allowed on from midnight until its manual override time
+    if "main_off" in cfg:
+        sched["main"] = (0, parse_minutes(cfg["main_off"]))
+    return sched
 
-def time_with_offset(base, offset):
-    """Apply offset in seconds to a time string"""
-    t = parse_time(base)
-    dt = datetime.datetime.combine(datetime.date.today(), t)
-    return (dt + datetime.timedelta(seconds=offset)).time()
 
+def build_masks(sched):
+    """Turn each (on_min, off_min) window into a 1440-bit int, one bit per minute of the day"""
+    masks = {}
+    for name, (on_min, off_min) in sched.items():
+        mask = 0
+        for m in range(1440):
+            if is_between_min(m, on_min, off_min):
+                mask |= 1 << m
+        masks[name] = mask
+    return masks
 
-def format_time(t):
-    """Format time object as HH:MM string"""
-    return t.strftime("%H:%M")
+
+FULL_DAY = (1 << 1440) - 1
+
+
+# Everything decide() needs for one tick, gathered once per loop iteration
+Tick = collections.namedtuple(
+    "Tick", "now_min lux threshold hysteresis main_mask aux_mask gallery_mask"
+)
+
+
+def decide(t, prev_mask):
+    """Return desired light states for Tick t as a bitmask (bit 0 main, 1 aux, 2 gallery)"""
+    now_min, lux, threshold, hysteresis, main_mask, aux_mask, gallery_mask = t
+
+    # Main: on while its window is open and it is dark, with hysteresis around
+    # threshold (cutoff threshold + hysteresis while ON, - hysteresis while OFF)
+    bias = hysteresis - 2 * hysteresis * (not prev_mask & 1)
+    main = (main_mask >> now_min) & (lux < threshold + bias)
+
+    # Gallery and Aux: Pure schedule-based control
+    aux     = (aux_mask >> now_min) & 1
+    gallery = (gallery_mask >> now_min) & 1
+    return main | aux << 1 | gallery << 2
+
+
+# -------------------- EVENTS --------------------
+def next_event_time(now, key, sched, check_interval):
+    """Return the next datetime after now at which event `key` is due"""
+    if key == "sensor":
+        return now + datetime.timedelta(seconds=check_interval)
+    if key == "midnight":
+        tomorrow = now.date() + datetime.timedelta(days=1)
+        return datetime.datetime.combine(tomorrow, datetime.time())
+
+    # Schedule edge "<name>_on" / "<name>_off": fire on the minute the window flips
+    name, edge = key.rsplit("_", 1)
+    minute = sched[name][edge == "off"]
+    dt = datetime.datetime.combine(now.date(), datetime.time(minute // 60, minute % 60))
+    if dt <= now:
+        dt += datetime.timedelta(days=1)
+    return dt
+
+
+def build_events(now, sched, check_interval):
+    """Build heap of upcoming (time, key) events: sensor poll, schedule edges, midnight"""
+    keys = ["sensor", "midnight"]
+    for name in sched:
+        keys += [f"{name}_on", f"{name}_off"]
+    events = [(next_event_time(now, k, sched, check_interval), k) for k in keys]
+    heapq.heapify(events)
+    return events
 
 # -------------------- STATE --------------------
 state = load_state()   # persisted desired state
+last_saved = tuple(sorted(state.items()))
+applied = {name: False for name in SPOTS}   # shadow of pin levels; all spots were cleared at startup
 last_day = None
 rnd_on = 0
 rnd_off = 0
+sched = {}             # name -> (on_min, off_min), rebuilt with the event queue
+masks = {}             # name -> 1440-bit minute mask of sched
+events = []            # heap of (datetime, key) upcoming events
+cfg_mtime = None       # config version sched/events were built from
+last_now = None        # wall time of the previous iteration, to spot clock steps
+log_flush_at = time.monotonic() + LOG_FLUSH_INTERVAL
+lux = None
+
+sensor_interval = read_config().get("check_interval", 60)
+threading.Thread(target=lux_worker, daemon=True).start()
+lux_ready.wait(timeout=5)
 
 # -------------------- MAIN LOOP --------------------
 try:
     while True:
         now = datetime.datetime.now()
+        now_min = now.hour * 60 + now.minute
+        now_day = now.day
         cfg = read_config()
 
         check_interval = cfg.get("check_interval", 60)
         threshold      = cfg.get("threshold", 120)
         hysteresis     = cfg.get("hysteresis", 15)
+        sensor_interval = check_interval
 
         # ---- Daily random offsets (reset at midnight) ----
-        if last_day != now.day:
+        if last_day != now_day:
             # Uncomment these for production use:
-            # rnd_on  = random.randint(60, 180)
-            # rnd_off = random.randint(180, 300)
+            # from random import randint
+            # rnd_on  = randint(60, 180)
+            # rnd_off = randint(180, 300)
             
             # For testing, keep at 0:
             rnd_on = 0
             rnd_off = 0
             
-            last_day = now.day
-            logging.info(f"New daily offsets: on={rnd_on}s off={rnd_off}s")
-
-        lux = get_lux()
-        logging.info(f"Brightness: {lux:.1f} lux")
-
-        # ---- Compute desired state for each light ----
-        def should_be_on(name):
-            """Determine if a light should be ON based on schedule and sensors"""
-            prev_state = state.get(name, False)
-
-            # Gallery and Aux: Pure schedule-based control
-            if name in ("gallery", "aux"):
-                on_k, off_k = f"{name}_on", f"{name}_off"
-                if on_k in cfg and off_k in cfg:
-                    # Apply random offsets to scheduled times
-                    on_t  = time_with_offset(cfg[on_k],  rnd_on)
-                    off_t = time_with_offset(cfg[off_k], rnd_off)
-                    
-                    # Check if current time is within the ON window
-                    result = is_between(now, format_time(on_t), format_time(off_t))
-                    return result
-                return False
-
-            # Main: Brightness-based with manual override
-            if name == "main":
-                # Check for manual override (main_off time reached)
-                if "main_off" in cfg:
-                    off_time = parse_time(cfg["main_off"])
-                    if now.time() >= off_time:
-                        return False
-                
-                # Brightness-based control with hysteresis
-                if prev_state:
-                    # Currently ON: turn off only if bright enough
-                    return lux < threshold + hysteresis
-                else:
-                    # Currently OFF: turn on only if dark enough
-                    return lux < threshold - hysteresis
-
-            return False
+            last_day = now_day
+            logging.info("New daily offsets: on=%ss off=%ss", rnd_on, rnd_off)
+            events = []
+
+        # Bound how long buffered records can be lost to a power cut; the loop
+        # wakes at least every check_interval, so this runs on time
+        if time.monotonic() >= log_flush_at:
+            log_buffer.flush()
+            log_flush_at = time.monotonic() + LOG_FLUSH_INTERVAL
+
+        # Wall clock stepped back (DST end, NTP correction): re-plan from the new time
+        if last_now is not None and now < last_now:
+            logging.info("Clock moved backwards — rebuilding event queue")
+            events = []
+        last_now = now
+
+        # ---- Rebuild schedule and event queue on new day or config change ----
+        if not events or cfg_mtime != _cfg_cache["mtime"]:
+            sched = build_schedule(cfg, rnd_on, rnd_off)
+            masks = build_masks(sched)
+            events = build_events(now, sched, check_interval)
+            cfg_mtime = _cfg_cache["mtime"]
+            lux = None
+            lux_resample.set()   # worker picks up a changed check_interval right away
+
+        # ---- Pop due events and queue their next occurrence ----
+        fired = set()
+        while events[0][0] <= now:
+            _, key = heapq.heappop(events)
+            fired.add(key)
+            heapq.heappush(events, (next_event_time(now, key, sched, check_interval), key))
+
+        # Schedule edges alone don't need a fresh sensor reading
+        if lux is None or "sensor" in fired:
+            lux = read_lux()
+            logging.debug("Brightness: %.1f lux", lux)
+
+        # ---- Compute desired state for all lights at once ----
+        tick = Tick(now_min, lux, threshold, hysteresis,
+                    masks.get("main", FULL_DAY), masks.get("aux", 0), masks.get("gallery", 0))
+        prev_mask = sum(bool(state.get(name)) << i for i, name in enumerate(NAMES))
+        new_mask = decide(tick, prev_mask)
 
         # ---- Apply state changes with edge detection ----
-        for name, led in SPOTS.items():
-            want = should_be_on(name)
+        for i, (name, pin) in enumerate(SPOTS.items()):
+            want = bool((new_mask >> i) & 1)
             prev = state.get(name)
 
             # Log state transitions
             if prev is None:
-                logging.info(f"{name} init: desired={want}")
+                logging.info("%s init: desired=%s", name, want)
             elif prev != want:
-                logging.info(f"{name} transition: {prev} -> {want}")
-
-            # Synchronize LED with desired state
-            if want:
-                if not led.is_lit:
-                    led.on()
-                    logging.info(f"{name} turned ON")
-            else:
-                if led.is_lit:
-                    led.off()
-                    logging.info(f"{name} turned OFF")
+                logging.info("%s transition: %s -> %s", name, prev, want)
+
+            # Synchronize LED with desired state; we are the only writer, so
+            # the shadow tells us the pin level without reading GPLEV0
+            if want != applied[name]:
+                if want:
+                    gpio_on(pin)
+                    logging.info("%s turned ON", name)
+                else:
+                    gpio_off(pin)
+                    logging.info("%s turned OFF", name)
+                applied[name] = want
 
             # Update state
             state[name] = want
 
-        save_state(state)
-        time.sleep(check_interval)
+        # Only touch the SD card when the state actually changed
+        snap = tuple(sorted(state.items()))
+        if snap != last_saved and save_state(state):
+            last_saved = snap
+
+        # ---- Sleep until the next event is due ----
+        # Deadlines are naive local times, so never sleep longer than one sensor
+        # interval: a clock step can't then stall sensor polls for an hour
+        sleep_s = (events[0][0] - datetime.datetime.now()).total_seconds()
+        if selector.select(timeout=min(max(0, sleep_s), check_interval)):
+            os.read(wake_r, 512)
+            logging.info("SIGHUP received — reloading config")
+            _cfg_cache["mtime"] = 0
+            events = []
 
 except KeyboardInterrupt:
     logging.info("Light manager stopped manually")
-    for s in SPOTS.values():
-        s.off()
+
+finally:
+    # Ctrl-C and systemctl stop (SIGTERM -> SystemExit) both switch everything
+    # off, including the status LED, so a dark status LED means "not running"
+    regs[GPCLR0] = SPOT_MASK | 1 << STATUS_LED
 